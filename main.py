@@ -17,16 +17,27 @@
 # https://github.com/magiausde/dcChooserBot
 
 # Generic imports
+import array
+import asyncio
 import configparser
+import hashlib
+import heapq
+import io
 import logging
+import math
 import os
 import pickle
+import random
 import secrets
+import struct
+import sys
+import time
 import traceback
 
 # Specific imports
 import discord
 from discord import app_commands
+from discord.ext import tasks
 
 # version info
 VERSION_INFO = '2023-05-23a'
@@ -75,23 +86,312 @@ logger.debug("REQUIRE_TREASURE: " + str(REQUIRE_TREASURE))
 MULTIPLE_BENEFITS = cfg_main.getboolean('Global', 'MultipleBenefits')
 logger.debug("MULTIPLE_BENEFITS: " + str(MULTIPLE_BENEFITS))
 
+# Use the (privileged) server members intent? Needed to apply benefits quickly in very large lobbies
+MEMBERS_INTENT = cfg_main.getboolean('Global', 'MembersIntent', fallback=False)
+logger.debug("MEMBERS_INTENT: " + str(MEMBERS_INTENT))
+
+# How much recent wins lower the chance of being chosen again? (0 = disabled)
+WIN_PENALTY = cfg_main.getfloat('Global', 'WinPenalty', fallback=0)
+if WIN_PENALTY < 0:
+    logger.warning("WinPenalty must not be negative, disabling it")
+    WIN_PENALTY = 0
+logger.debug("WIN_PENALTY: " + str(WIN_PENALTY))
+
+# After how many hours does a win only count half?
+WIN_PENALTY_HALF_LIFE = cfg_main.getfloat('Global', 'WinPenaltyHalfLifeHours', fallback=168) * 3600
+if WIN_PENALTY_HALF_LIFE <= 0:
+    logger.warning("WinPenaltyHalfLifeHours must be greater than 0, using 168")
+    WIN_PENALTY_HALF_LIFE = 168 * 3600
+logger.debug("WIN_PENALTY_HALF_LIFE: " + str(WIN_PENALTY_HALF_LIFE))
+
+# Directory holding the win history, one file per server
+WIN_HISTORY_DIR = 'winhistory'
+# Wins that decayed below this score are forgotten by the janitor
+WIN_HISTORY_MIN_SCORE = 0.01
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+# Seconds to wait between the messages of an announcement, so we do not run into rate limits
+ANNOUNCEMENT_DELAY = 1
+# From this amount of chosen users on, the announcement gets a CSV file with their IDs attached
+ANNOUNCEMENT_FILE_THRESHOLD = 100
+
+# How many users the streaming mode reads before looking up their roles (Discord allows querying 100 at once)
+STREAMING_BATCH_SIZE = 100
+
+# Append-only log of all choosing-rounds and its index (server id, timestamp and position of each round)
+ROUNDLOG_FILE = 'roundlog.bin'
+ROUNDLOG_INDEX_FILE = 'roundlog.idx'
+# When the round log grows beyond this size, it is archived and the new one starts with the latest rounds of each
+# server. These take up at most half of this size, so the new round log does not have to be archived right away
+ROUNDLOG_MAX_BYTES = 64 * 1024 * 1024
+ROUNDLOG_KEEP_ROUNDS = 20
+# Round log record: server id, timestamp, seed, seed commitment, choosing mode, amount of users demanded
+# (at most the amount of participants), amount of participants, amount of winners.
+# Followed by the participant ids, the participants' weights and the winner ids (all little-endian)
+ROUNDLOG_HEADER = struct.Struct('<Qd32s32sBIII')
+# Choosing modes, they use the seed differently: get_chosen_weighted and get_chosen_streaming
+ROUND_MODE_WEIGHTED = 0
+ROUND_MODE_STREAMING = 1
+# Round log index entry: server id, timestamp, offset of the record in ROUNDLOG_FILE
+ROUNDLOG_INDEX_ENTRY = struct.Struct('<QdQ')
+
+# How often the janitor cleans up data of departed servers, deleted roles and deleted messages
+JANITOR_INTERVAL_MINUTES = 60
+# How many servers the janitor checks before letting other events run
+JANITOR_SLICE_SIZE = 20
+
+# Admission control - every command takes tokens from the bucket of its server and from the global bucket.
+# Buckets refill continuously (tokens per second) up to their burst size
+ADMISSION_SERVER_RATE = 1
+ADMISSION_SERVER_BURST = 10
+ADMISSION_GLOBAL_RATE = 20
+ADMISSION_GLOBAL_BURST = 40
+# Commands that cannot run right away wait at most this many seconds (Discord expects an answer within 3 seconds)
+ADMISSION_MAX_WAIT = 2
+# Commands are only queued if their expected wait is at least this much shorter, so they are not shed after waiting
+ADMISSION_WAIT_MARGIN = 0.25
+# How many commands may wait at the same time
+ADMISSION_MAX_QUEUE = 100
+# Priority (lower runs first) and cost in tokens of each command
+COMMAND_COSTS = {
+    'version': (0, 1),
+    'getmodrole': (0, 1),
+    'listbenefits': (0, 1),
+    'loadstats': (0, 1),
+    'settreasure': (1, 1),
+    'setuserchannel': (1, 1),
+    'setmodrole': (1, 1),
+    'setbenefit': (1, 1),
+    'rounds': (1, 3),
+    'new': (2, 2),
+    'choose': (2, 4),
+}
+# Priority and cost of commands not listed above
+DEFAULT_COMMAND_COST = (1, 1)
+# Commands that do a lot before replying. They are never queued, as the wait would leave them too little of
+# the 3 seconds Discord gives them to reply
+SLOW_COMMANDS = ('new', 'choose')
+
 logger.debug("Starting bot")
 
 # runtime_data stores all the settings and will be loaded from the filesystem (if available)
 runtime_data = {}
 # if a user does not allow bot messages initially, these will be sent when the user messages the bot once via DM
 dm_backlog = {}
+# rendered responses of read-only commands (e.g. /listbenefits) per server, dropped whenever the server's data changes
+response_cache = {}
+# recent wins per server and user as (decayed score, timestamp of last update), loaded from the filesystem (if available)
+win_history = {}
+# servers whose saved IDs could not be turned into objects yet, because they were unavailable
+unresolved_servers = set()
+# position of the logged rounds per server as (timestamp, offset in ROUNDLOG_FILE), oldest first
+round_index = {}
+
+
+class TokenBucket:
+    """
+    Token bucket for rate limiting. Refills continuously with `rate` tokens per second, up to `burst` tokens.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        """
+        Adds the tokens accumulated since the last refill.
+        :param now: Current time.monotonic()
+        :return: nothing
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, cost, now):
+        """
+        Returns how long to wait until the bucket has enough tokens.
+        :param cost: Tokens needed
+        :param now: Current time.monotonic()
+        :return: Seconds to wait, 0 if enough tokens are available
+        """
+        self.refill(now)
+        return max(0, (cost - self.tokens) / self.rate)
+
+
+class AdmissionControl:
+    """
+    Decides if a command may run: right away, after waiting shortly in a priority queue, or not at all (shed).
+    Cheap read-only commands have the highest priority.
+    """
+    def __init__(self):
+        self.global_bucket = TokenBucket(ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST)
+        self.server_buckets = {}
+        # list of (priority, position, serverid, cost, future) for commands waiting to run
+        self.queue = []
+        self.queued_amount = 0
+        self.dispatcher = None
+        # set when a command was queued, so the dispatcher does not sleep through it.
+        # created with the dispatcher, as it has to belong to the running event loop
+        self.wakeup = None
+        # per server: how many commands were admitted, queued and shed
+        self.stats = {}
+
+    def get_wait(self, serverid, cost, now, server_ahead=0, global_ahead=0):
+        """
+        Returns how long a command has to wait until both its server's bucket and the global bucket allow it.
+        :param serverid: The server's id the command was used on
+        :param cost: Tokens the command costs
+        :param now: Current time.monotonic()
+        :param server_ahead: Tokens of the server's bucket already promised to commands queued ahead
+        :param global_ahead: Tokens of the global bucket already promised to commands queued ahead
+        :return: Seconds to wait, 0 if the command may run right away
+        """
+        if serverid not in self.server_buckets:
+            self.server_buckets[serverid] = TokenBucket(ADMISSION_SERVER_RATE, ADMISSION_SERVER_BURST)
+        return max(self.server_buckets[serverid].get_wait(cost + server_ahead, now),
+                   self.global_bucket.get_wait(cost + global_ahead, now))
+
+    def take(self, serverid, cost):
+        """
+        Takes the tokens of a command that is about to run.
+        :param serverid: The server's id the command was used on
+        :param cost: Tokens the command costs
+        :return: nothing
+        """
+        self.server_buckets[serverid].tokens -= cost
+        self.global_bucket.tokens -= cost
+
+    def count(self, serverid, kind):
+        """
+        Counts an admitted, queued or shed command for the statistics.
+        :param serverid: The server's id the command was used on
+        :param kind: 'admitted', 'queued' or 'shed'
+        :return: nothing
+        """
+        if serverid not in self.stats:
+            self.stats[serverid] = {'admitted': 0, 'queued': 0, 'shed': 0}
+        self.stats[serverid][kind] += 1
+
+    async def admit(self, serverid, command):
+        """
+        Waits until a command may run.
+        :param serverid: The server's id the command was used on
+        :param command: Name of the command
+        :return: Whether the command may run and, if not, after how many seconds to retry
+        """
+        priority, cost = COMMAND_COSTS.get(command, DEFAULT_COMMAND_COST)
+
+        # the commands queued with the same or a higher priority get their tokens first
+        ahead = [entry for entry in self.queue if entry[0] <= priority and not entry[4].done()]
+        wait = self.get_wait(serverid, cost, time.monotonic(),
+                             sum([entry[3] for entry in ahead if entry[2] == serverid]),
+                             sum([entry[3] for entry in ahead]))
+
+        if wait == 0:  # enough tokens, even after the commands queued ahead
+            self.take(serverid, cost)
+            self.count(serverid, 'admitted')
+            return True, 0
+
+        # would take too long, no room to wait or the command could not reply in time after waiting
+        if wait > ADMISSION_MAX_WAIT - ADMISSION_WAIT_MARGIN or len(self.queue) >= ADMISSION_MAX_QUEUE or (
+                command in SLOW_COMMANDS):
+            logger.info("Shedding command " + str(command) + " on " + str(serverid) + ", retry after " + str(wait))
+            self.count(serverid, 'shed')
+            return False, max(wait, 1)
+
+        logger.debug("Queueing command " + str(command) + " on " + str(serverid) + ", expected wait " + str(wait))
+        self.count(serverid, 'queued')
+        future = asyncio.get_running_loop().create_future()
+        self.queued_amount += 1
+        self.queue.append((priority, self.queued_amount, serverid, cost, future))
+        if not self.dispatcher or self.dispatcher.done():
+            if not self.wakeup:
+                self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        else:
+            self.wakeup.set()
+
+        try:
+            await asyncio.wait_for(future, ADMISSION_MAX_WAIT)
+        except asyncio.TimeoutError:  # other commands were preferred
+            logger.info("Shedding queued command " + str(command) + " on " + str(serverid))
+            self.count(serverid, 'shed')
+            return False, max(self.get_wait(serverid, cost, time.monotonic()), 1)
+
+        self.count(serverid, 'admitted')
+        return True, 0
+
+    async def dispatch(self):
+        """
+        Lets the waiting commands run, in order of their priority, as soon as their buckets allow it.
+        A command whose server has no tokens left does not hold up commands of other servers.
+        :return: nothing
+        """
+        while self.queue:
+            now = time.monotonic()
+            shortest_wait = ADMISSION_MAX_WAIT
+            remaining = []  # commands that still have to wait
+            self.queue.sort()  # highest priority first, same priority in order of arrival
+            for entry in self.queue:
+                _, _, serverid, cost, future = entry
+                if future.done():  # waited too long, was shed already
+                    continue
+
+                wait = self.get_wait(serverid, cost, now)
+                if wait == 0:
+                    self.take(serverid, cost)
+                    future.set_result(True)
+                else:
+                    remaining.append(entry)
+                    shortest_wait = min(shortest_wait, wait)
+
+            self.queue = remaining
+            if self.queue:  # sleep until tokens are available or another command was queued
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), shortest_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def forget(self, serverid):
+        """
+        Removes the bucket and statistics of a server, e.g. when the bot left it.
+        :param serverid: The server's id to remove the data for
+        :return: nothing
+        """
+        self.server_buckets.pop(serverid, None)
+        self.stats.pop(serverid, None)
+
+
+admission_control = AdmissionControl()
+
+
+class ChooserCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        """
+        Admission control - runs before every command.
+        If there is too much going on, the user is asked to try again later.
+        """
+        command = interaction.command.name if interaction.command else None
+        admitted, retry_after = await admission_control.admit(interaction.guild_id or 0, command)
+        if not admitted:
+            await interaction.response.send_message(
+                "I am quite busy right now! Please try again in " + str(math.ceil(retry_after)) + " second(s).",
+                ephemeral=True)
+        return admitted
 
 
 class ChooserClient(discord.Client):
     def __init__(self, *, intents: discord.Intents, status: discord.Status, activity):
         super().__init__(intents=intents, status=status, activity=activity)
         # Setup the command tree
-        self.tree = app_commands.CommandTree(self)
+        self.tree = ChooserCommandTree(self)
 
 
 logger.debug("Preparing bot object")
 myIntents = discord.Intents.default()
+myIntents.members = MEMBERS_INTENT
 
 # Setup of the bot
 client = ChooserClient(intents=myIntents, status=discord.Status.dnd,
@@ -125,15 +425,16 @@ def save_runtime_data():
             value = runtime_data[server][attrib]
             logger.debug('runtime_data for ' + str(server) + ', ' + attrib + ': ' + str(value))
 
+            # values of servers that were not resolved yet are IDs already
             if attrib == 'userchannel':
                 original_channels[server] = value
-                runtime_data[server][attrib] = value.id
+                runtime_data[server][attrib] = getattr(value, 'id', value)
             if attrib == 'modrole':
                 original_roles[server] = value
-                runtime_data[server][attrib] = value.id
+                runtime_data[server][attrib] = getattr(value, 'id', value)
             if attrib == 'reference_new':
                 original_references[server] = value
-                runtime_data[server][attrib] = value.id
+                runtime_data[server][attrib] = getattr(value, 'id', value)
 
     # save runtime data to the filesystem
     with open('runtimedata.pkl', 'wb+') as f:
@@ -148,7 +449,7 @@ def save_runtime_data():
         runtime_data[server]['modrole'] = original_roles[server]
 
     # restore the real references
-    for server in original_roles:
+    for server in original_references:
         runtime_data[server]['reference_new'] = original_references[server]
 
 
@@ -167,29 +468,73 @@ async def load_runtime_data():
 
     # workaround for pickle that cannot save weakref objects (channel object)
     # turn IDs into the corresponding objects
-    for server in runtime_data:
-        if "userchannel" in runtime_data[server]:
-            channel = await client.fetch_channel(runtime_data[server]["userchannel"])
-            if channel:
-                logger.debug("Userchannel fetched successfully!")
-            else:
-                logger.warning("Userchannel failed to fetch!")
-            runtime_data[server]["userchannel"] = channel
-        if "modrole" in runtime_data[server]:
-            serverobject = client.get_guild(server)
-            modrole = discord.utils.get(serverobject.roles, id=runtime_data[server]["modrole"])
-            if modrole:
-                logger.debug("Modrole fetched successfully!")
-            else:
-                logger.warning("Modrole failed to fetch!")
-            runtime_data[server]["modrole"] = modrole
-        if "reference_new" in runtime_data[server] and channel:
-            messageobject = await channel.fetch_message(runtime_data[server]["reference_new"])
-            if messageobject:
-                logger.debug("Reference fetched successfully!")
-            else:
-                logger.warning("Reference failed to fetch!")
-            runtime_data[server]["reference_new"] = messageobject
+    changed = False
+    for server in list(runtime_data):
+        if not client.get_guild(server):  # we are not a member of this server anymore, no need to fetch anything
+            logger.info("No longer member of server " + str(server) + ", removing its data")
+            evict_server(server)
+            changed = True
+        elif await resolve_server_data(server):
+            changed = True
+
+    # objects that failed to fetch are removed when saving
+    if changed:
+        save_runtime_data()
+
+
+async def resolve_server_data(serverid):
+    """
+    Turns the saved IDs of a server into the corresponding objects.
+    Servers that are unavailable (e.g. Discord outage) are skipped, they are resolved once they are available again.
+    :param serverid: The server's id to resolve the data for
+    :return: If something could not be resolved and was removed (runtime_data has to be saved then)
+    """
+    serverobject = client.get_guild(serverid)
+    if serverobject.unavailable:
+        logger.warning("Server " + str(serverid) + " is unavailable, resolving its data later")
+        unresolved_servers.add(serverid)
+        return False
+    unresolved_servers.discard(serverid)
+
+    server_data = runtime_data[serverid]
+    changed = False
+    channel = None
+    if "userchannel" in server_data:
+        try:
+            channel = await client.fetch_channel(server_data["userchannel"])
+        except (discord.errors.NotFound, discord.errors.Forbidden):
+            channel = None
+        if channel:
+            logger.debug("Userchannel fetched successfully!")
+        else:
+            logger.warning("Userchannel failed to fetch!")
+            changed = True
+        server_data["userchannel"] = channel
+    if "modrole" in server_data:
+        modrole = serverobject.get_role(server_data["modrole"])
+        if modrole:
+            logger.debug("Modrole fetched successfully!")
+        else:
+            # keep it, the janitor removes it if the role was deleted
+            logger.warning("Modrole failed to fetch!")
+            modrole = discord.Object(id=server_data["modrole"])
+        server_data["modrole"] = modrole
+    if "reference_new" in server_data:
+        messageobject = None
+        if channel:
+            try:
+                messageobject = await channel.fetch_message(server_data["reference_new"])
+            except discord.errors.NotFound:
+                messageobject = None
+        if messageobject:
+            logger.debug("Reference fetched successfully!")
+        else:
+            logger.warning("Reference failed to fetch!")
+            changed = True
+        server_data["reference_new"] = messageobject
+
+    return changed
+
 
 def set_runtime_data(serverid, key, value):
     """
@@ -206,6 +551,7 @@ def set_runtime_data(serverid, key, value):
 
     # Store the value and save
     runtime_data[serverid][key] = value
+    invalidate_cached_responses(serverid)
     save_runtime_data()
 
 
@@ -248,9 +594,464 @@ def set_rolebenefit(serverid, roleid, benefit):
     else:
         runtime_data[serverid]['rolebenefits'].pop(roleid)
 
+    invalidate_cached_responses(serverid)
     save_runtime_data()
 
 
+def get_cached_response(serverid, command):
+    """
+    Returns the rendered response of a read-only command, if it was cached before
+    :param serverid: The server's id the response belongs to
+    :param command: Name of the command the response was rendered for
+    :return: Cached response or None if nothing cached
+    """
+    if serverid in response_cache:
+        if command in response_cache[serverid]:
+            logger.debug("Cache hit - " + str(serverid) + ", " + command)
+            return response_cache[serverid][command]
+
+    return None
+
+
+def set_cached_response(serverid, command, response):
+    """
+    Caches the rendered response of a read-only command
+    :param serverid: The server's id the response belongs to
+    :param command: Name of the command the response was rendered for
+    :param response: The rendered response
+    :return: nothing
+    """
+    if serverid not in response_cache:
+        response_cache[serverid] = {}
+
+    response_cache[serverid][command] = response
+
+
+def invalidate_cached_responses(serverid):
+    """
+    Drops all cached responses of a server.
+    Has to be executed every time something changes the output of a read-only command.
+    :param serverid: The server's id to drop the cached responses for
+    :return: nothing
+    """
+    if response_cache.pop(serverid, None):
+        logger.debug("Dropped cached responses for " + str(serverid))
+
+
+def get_win_history_file(serverid):
+    """
+    Returns the file a server's win history is saved to.
+    :param serverid: The server's id
+    :return: Path of the file
+    """
+    return os.path.join(WIN_HISTORY_DIR, str(serverid) + '.pkl')
+
+
+def load_win_history():
+    """
+    Loads the saved win history of all servers from the filesystem into win_history.
+    Usually only executed on startup.
+    :return: nothing
+    """
+    global win_history
+    logger.debug("Loading win history")
+    win_history = {}
+
+    if os.path.isdir(WIN_HISTORY_DIR):  # if data was saved before
+        for filename in os.listdir(WIN_HISTORY_DIR):
+            if filename.endswith('.pkl'):
+                with open(os.path.join(WIN_HISTORY_DIR, filename), 'rb') as f:
+                    win_history[int(filename[:-4])] = pickle.load(f)
+
+
+def save_win_history(serverid):
+    """
+    Saves the win history of a single server to the filesystem, so a round does not rewrite the other servers.
+    :param serverid: The server's id to save the win history for
+    :return: nothing
+    """
+    logger.debug("Saving win history - " + str(serverid))
+    filename = get_win_history_file(serverid)
+
+    if serverid not in win_history:  # nothing (left) to save
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+
+    os.makedirs(WIN_HISTORY_DIR, exist_ok=True)
+    # write to a temporary file first, so a crash does not leave a broken file behind
+    with open(filename + '.tmp', 'wb+') as f:
+        pickle.dump(win_history[serverid], f, pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
+
+
+def prune_win_history(serverid):
+    """
+    Removes wins of a server that decayed so far that they do not matter anymore.
+    Executed by the janitor. Call save_win_history afterwards.
+    :param serverid: The server's id to prune the win history for
+    :return: How many users were removed
+    """
+    if serverid not in win_history:
+        return 0
+
+    now = int(time.time())
+    server_wins = win_history[serverid]
+    pruned = 0
+    for userid in list(server_wins):
+        if get_decayed_wins(serverid, userid, now) < WIN_HISTORY_MIN_SCORE:
+            server_wins.pop(userid)
+            pruned += 1
+    if not server_wins:  # no one won recently on this server
+        win_history.pop(serverid)
+
+    return pruned
+
+
+def get_decayed_wins(serverid, userid, now):
+    """
+    Returns how many recent wins a user has. Each win loses half of its value every WIN_PENALTY_HALF_LIFE.
+    :param serverid: The server's id the wins belong to
+    :param userid: The user's id to get the wins for
+    :param now: Current unix timestamp
+    :return: Decayed amount of wins, 0 if the user did not win yet
+    """
+    if serverid in win_history and userid in win_history[serverid]:
+        score, timestamp = win_history[serverid][userid]
+        return score * 0.5 ** ((now - timestamp) / WIN_PENALTY_HALF_LIFE)
+
+    return 0
+
+
+def record_win(serverid, userid):
+    """
+    Adds a win to a user's win history. Call save_win_history for the server afterwards.
+    :param serverid: The server's id the user won on
+    :param userid: The user's id that won
+    :return: nothing
+    """
+    logger.debug("Recording win - " + str(serverid) + ", " + str(userid))
+    now = int(time.time())
+    if serverid not in win_history:
+        win_history[serverid] = {}
+
+    win_history[serverid][userid] = (get_decayed_wins(serverid, userid, now) + 1, now)
+
+
+def get_win_penalty(serverid, userid):
+    """
+    Returns the factor a user's weight is multiplied with because of recent wins.
+    :param serverid: The server's id where choosing takes place
+    :param userid: The user's id to get the penalty for
+    :return: Factor between 0 (exclusive) and 1, 1 if the user has no recent wins or the penalty is disabled
+    """
+    if not WIN_PENALTY:
+        return 1
+
+    penalty = 1 / (1 + WIN_PENALTY * get_decayed_wins(serverid, userid, int(time.time())))
+    logger.debug("Win penalty for " + str(userid) + ": " + str(penalty))
+    return penalty
+
+
+def new_round(serverid, mode, amount):
+    """
+    Starts the record of a choosing-round, including the seed of its random generator.
+    The choosing methods add the participants and weights, finish_round adds the winners.
+    :param serverid: The server's id where choosing takes place
+    :param mode: How the users are chosen (ROUND_MODE_WEIGHTED or ROUND_MODE_STREAMING)
+    :param amount: How many users were demanded
+    :return: dict representing the round
+    """
+    # the seed comes from secrets, as random alone was not random enough.
+    # seeding a generator makes the round reproducible from the round log
+    seed = secrets.token_bytes(32)
+    return {'serverid': serverid, 'timestamp': time.time(), 'seed': seed,
+            'commitment': hashlib.sha256(seed).digest(), 'rng': random.Random(seed), 'mode': mode, 'amount': amount,
+            'participants': array.array('Q'), 'weights': array.array('d'), 'winners': array.array('Q')}
+
+
+def load_round_index():
+    """
+    Loads the index of the round log into round_index.
+    Usually only executed on startup.
+    :return: nothing
+    """
+    global round_index
+    logger.debug("Loading round log index")
+    round_index = {}
+
+    if os.path.exists(ROUNDLOG_INDEX_FILE):
+        with open(ROUNDLOG_INDEX_FILE, 'rb') as f:
+            data = f.read()
+
+        # an incomplete entry at the end (e.g. crash while writing) is ignored
+        usable = len(data) - len(data) % ROUNDLOG_INDEX_ENTRY.size
+        for serverid, timestamp, offset in ROUNDLOG_INDEX_ENTRY.iter_unpack(data[:usable]):
+            if serverid not in round_index:
+                round_index[serverid] = []
+            round_index[serverid].append((timestamp, offset))
+
+
+def write_round(round_entry):
+    """
+    Appends a round to the round log and its index.
+    :param round_entry: dict representing the round (see new_round)
+    :return: nothing
+    """
+    participants = round_entry['participants']
+    winners = round_entry['winners']
+
+    with open(ROUNDLOG_FILE, 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(ROUNDLOG_HEADER.pack(round_entry['serverid'], round_entry['timestamp'], round_entry['seed'],
+                                     round_entry['commitment'], round_entry['mode'], round_entry['amount'],
+                                     len(participants), len(winners)))
+        f.write(struct.pack('<' + str(len(participants)) + 'Q', *participants))
+        f.write(struct.pack('<' + str(len(participants)) + 'd', *round_entry['weights']))
+        f.write(struct.pack('<' + str(len(winners)) + 'Q', *winners))
+
+    with open(ROUNDLOG_INDEX_FILE, 'ab') as f:
+        f.write(ROUNDLOG_INDEX_ENTRY.pack(round_entry['serverid'], round_entry['timestamp'], offset))
+
+    if round_entry['serverid'] not in round_index:
+        round_index[round_entry['serverid']] = []
+    round_index[round_entry['serverid']].append((round_entry['timestamp'], offset))
+
+
+def read_round(f, offset):
+    """
+    Reads a single round from the round log.
+    :param f: Opened (binary) round log
+    :param offset: Position of the round in the round log
+    :return: dict representing the round (see new_round), without the random generator
+    """
+    f.seek(offset)
+    serverid, timestamp, seed, commitment, mode, amount, participants_amount, winners_amount = ROUNDLOG_HEADER.unpack(
+        f.read(ROUNDLOG_HEADER.size))
+
+    return {'serverid': serverid, 'timestamp': timestamp, 'seed': seed, 'commitment': commitment, 'mode': mode,
+            'amount': amount,
+            'participants': array.array('Q', struct.unpack('<' + str(participants_amount) + 'Q',
+                                                           f.read(8 * participants_amount))),
+            'weights': array.array('d', struct.unpack('<' + str(participants_amount) + 'd',
+                                                      f.read(8 * participants_amount))),
+            'winners': array.array('Q', struct.unpack('<' + str(winners_amount) + 'Q', f.read(8 * winners_amount)))}
+
+
+def get_recent_rounds(serverid, amount):
+    """
+    Returns the latest rounds of a server from the round log. Only these rounds are read, thanks to round_index.
+    :param serverid: The server's id to get the rounds for
+    :param amount: How many rounds to return at most
+    :return: List of dicts representing the rounds (see read_round), newest first
+    """
+    if serverid not in round_index or amount < 1:
+        return []
+
+    with open(ROUNDLOG_FILE, 'rb') as f:
+        return [read_round(f, offset) for _, offset in reversed(round_index[serverid][-amount:])]
+
+
+def get_round_size(f, offset):
+    """
+    Returns how many bytes a round takes up in the round log.
+    :param f: Opened (binary) round log
+    :param offset: Position of the round in the round log
+    :return: Size of the round, in bytes
+    """
+    f.seek(offset)
+    participants_amount, winners_amount = ROUNDLOG_HEADER.unpack(f.read(ROUNDLOG_HEADER.size))[-2:]
+    return ROUNDLOG_HEADER.size + 16 * participants_amount + 8 * winners_amount
+
+
+def compact_round_log():
+    """
+    Archives the round log under a new name (archives are never overwritten) and starts a new one.
+    The new round log contains the latest ROUNDLOG_KEEP_ROUNDS rounds of each server, as long as they fit into
+    half of ROUNDLOG_MAX_BYTES.
+    :return: nothing
+    """
+    global round_index
+    logger.info("Round log exceeds " + str(ROUNDLOG_MAX_BYTES) + " bytes, archiving and compacting it")
+
+    # e.g. roundlog-20230523-184500.bin
+    base = os.path.splitext(ROUNDLOG_FILE)[0] + '-' + time.strftime('%Y%m%d-%H%M%S')
+    archive = base
+    number = 1
+    while os.path.exists(archive + '.bin') or os.path.exists(archive + '.idx'):
+        number += 1
+        archive = base + '-' + str(number)
+    os.replace(ROUNDLOG_FILE, archive + '.bin')
+    if os.path.exists(ROUNDLOG_INDEX_FILE):
+        os.replace(ROUNDLOG_INDEX_FILE, archive + '.idx')
+    logger.info("Round log archived as " + archive + ".bin")
+
+    with open(archive + '.bin', 'rb') as f:
+        # newest first, so the latest rounds are kept if not all of them fit
+        kept = []
+        kept_bytes = 0
+        for offset in sorted([offset for serverid in round_index
+                              for _, offset in round_index[serverid][-ROUNDLOG_KEEP_ROUNDS:]], reverse=True):
+            size = get_round_size(f, offset)
+            if kept_bytes + size <= ROUNDLOG_MAX_BYTES // 2:
+                kept.append(offset)
+                kept_bytes += size
+
+        # keep the original order of the rounds
+        round_index = {}
+        for offset in sorted(kept):
+            write_round(read_round(f, offset))
+
+    logger.info("Round log compacted, " + str(len(kept)) + " round(s) kept")
+
+
+def append_round(round_entry):
+    """
+    Saves a finished round to the round log. Compacts the round log first, if it became too large.
+    :param round_entry: dict representing the round (see new_round)
+    :return: nothing
+    """
+    logger.debug("Appending round to round log - " + str(round_entry['serverid']))
+    if os.path.exists(ROUNDLOG_FILE) and os.path.getsize(ROUNDLOG_FILE) > ROUNDLOG_MAX_BYTES:
+        compact_round_log()
+
+    write_round(round_entry)
+
+
+def evict_server(serverid):
+    """
+    Removes all data of a server, e.g. when the bot left it.
+    The round log is kept, it is an audit log. Call save_runtime_data afterwards.
+    :param serverid: The server's id to remove the data for
+    :return: Approximate amount of memory reclaimed, in bytes
+    """
+    logger.debug("Evicting data of server " + str(serverid))
+    reclaimed = 0
+
+    for server_data in (runtime_data, win_history, response_cache):
+        if serverid in server_data:
+            entries = server_data.pop(serverid)
+            reclaimed += sys.getsizeof(entries) + sum([sys.getsizeof(value) for value in entries.values()])
+    save_win_history(serverid)  # removes the file, as the win history is gone
+    admission_control.forget(serverid)
+    unresolved_servers.discard(serverid)
+
+    return reclaimed
+
+
+async def clean_server(serverid, report):
+    """
+    Removes data of a single server that is not needed anymore:
+    all of it if the bot left the server, benefits and modrole of deleted roles and lobbies whose message is gone.
+    :param serverid: The server's id to clean up
+    :param report: dict counting what was removed, gets updated
+    :return: nothing
+    """
+    serverobject = client.get_guild(serverid)
+    if not serverobject:  # we are not a member of this server anymore
+        logger.debug("Janitor - no longer member of server " + str(serverid))
+        report['memory'] += evict_server(serverid)
+        report['servers'] += 1
+        return
+
+    # wins that do not matter anymore
+    pruned = prune_win_history(serverid)
+    if pruned:
+        logger.debug("Janitor - removed " + str(pruned) + " outdated win(s) on " + str(serverid))
+        save_win_history(serverid)
+        report['wins'] += pruned
+
+    if serverid not in runtime_data:  # only a win history is left for this server
+        return
+    if serverobject.unavailable or serverid in unresolved_servers:  # roles and channels are not known right now
+        logger.debug("Janitor - server " + str(serverid) + " is unavailable, skipping")
+        return
+    server_data = runtime_data[serverid]
+    changed = False
+
+    # benefits for roles that were deleted
+    benefit_roles = server_data.get('rolebenefits') or {}
+    for roleid in list(benefit_roles):
+        if not serverobject.get_role(roleid):
+            logger.debug("Janitor - removing benefit of deleted role " + str(roleid) + " on " + str(serverid))
+            benefit_roles.pop(roleid)
+            report['memory'] += sys.getsizeof(roleid)
+            report['roles'] += 1
+            changed = True
+
+    # modrole that was deleted
+    modrole = server_data.get('modrole')
+    if modrole and not serverobject.get_role(modrole.id):
+        logger.debug("Janitor - removing deleted modrole " + str(modrole.id) + " on " + str(serverid))
+        server_data['modrole'] = None
+        report['roles'] += 1
+        changed = True
+
+    # lobby whose channel or message is gone
+    reference_new = server_data.get('reference_new')
+    if reference_new:
+        userchannel = server_data.get('userchannel')
+        message_exists = False
+        if userchannel and serverobject.get_channel(userchannel.id):
+            try:
+                await userchannel.fetch_message(reference_new.id)
+                message_exists = True
+            except discord.errors.NotFound:  # other errors (e.g. missing permissions) do not mean it is gone
+                message_exists = False
+
+        if not message_exists:
+            logger.debug("Janitor - removing lobby of deleted message " + str(reference_new.id) + " on " + str(
+                serverid))
+            server_data['reference_new'] = None
+            report['lobbies'] += 1
+            changed = True
+
+    if changed:
+        invalidate_cached_responses(serverid)
+
+
+def get_data_file_sizes():
+    """
+    Returns how much disk space the saved data uses.
+    :return: Size of runtime data and win history files, in bytes
+    """
+    filenames = ['runtimedata.pkl']
+    if os.path.isdir(WIN_HISTORY_DIR):
+        filenames += [os.path.join(WIN_HISTORY_DIR, filename) for filename in os.listdir(WIN_HISTORY_DIR)]
+    return sum([os.path.getsize(filename) for filename in filenames if os.path.exists(filename)])
+
+
+@tasks.loop(minutes=JANITOR_INTERVAL_MINUTES)
+async def janitor():
+    """
+    Background cleanup of data that is not needed anymore (see clean_server).
+    Servers are checked in small slices, so other events are not blocked.
+    :return: nothing
+    """
+    logger.debug("Janitor started")
+    report = {'servers': 0, 'roles': 0, 'lobbies': 0, 'wins': 0, 'memory': 0}
+    disk_before = get_data_file_sizes()
+
+    serverids = list(runtime_data) + [serverid for serverid in win_history if serverid not in runtime_data]
+    for index in range(0, len(serverids), JANITOR_SLICE_SIZE):
+        for serverid in serverids[index:index + JANITOR_SLICE_SIZE]:
+            try:
+                await clean_server(serverid, report)
+            except discord.errors.HTTPException as error:  # e.g. missing permissions, try again next time
+                logger.warning("Janitor could not check server " + str(serverid) + ": " + str(error))
+        await asyncio.sleep(0)  # let other events run
+
+    if report['servers'] or report['roles'] or report['lobbies'] or report['wins']:
+        save_runtime_data()
+        logger.info("Janitor removed " + str(report['servers']) + " server(s), " + str(report['roles']) + " role(s), " +
+                    str(report['lobbies']) + " lobby(s), " + str(report['wins']) + " outdated win(s). Reclaimed about " +
+                    str(report['memory']) +
+                    " bytes of memory and " + str(disk_before - get_data_file_sizes()) + " bytes of disk space")
+    else:
+        logger.debug("Janitor done, nothing to clean up")
+
+
 def get_interaction_summary(interaction: discord.Interaction):
     """
     Provides a interaction summary, mainly used by logging.
@@ -281,34 +1082,28 @@ def is_management_permitted(interaction: discord.Interaction):
     :return: if the user (from interaction) is allowed to perform management-actions
     """
     logger.debug("Checking management permissions for user " + printuser(interaction.user))
+    modrole = get_runtime_data(interaction.guild.id, 'modrole')
     imp = interaction.user.guild_permissions.administrator or (
-            get_runtime_data(interaction.guild.id, 'modrole') in interaction.user.roles)
+            modrole is not None and interaction.user.get_role(modrole.id) is not None)
     logger.debug("Is permitted? " + str(imp))
     return imp
 
 
-def log_probabilities(users_list):
+def log_probabilities(users_list, weights):
     """
     Debug-method which calculates each user's probability of being chosen.
-    :param users_list: List of User-objects to count/calculate
+    :param users_list: List of User-objects to calculate
+    :param weights: Weight of each user in users_list
     :return: nothing
     """
     logger.debug("Logging the probabilities for this turn:")
 
-    counts = {}
-
-    # count how often the user is in the users_list
-    for user in users_list:
-        if user.id in counts:
-            counts[user.id] += 1
-        else:
-            counts[user.id] = 1
+    total = sum(weights)
 
     # calculate the probability for each user
-    # Example - 16.6667% 1/6: 12345678987654321
-    for entry in counts:
-        logger.debug(str(round(counts[entry] / len(users_list) * 100, 4)) + "% " + str(counts[entry]) + "/" + str(
-            len(users_list)) + ": " + str(entry))
+    # Example - 16.6667% 1.0/6.0: 12345678987654321
+    for user, weight in zip(users_list, weights):
+        logger.debug(str(round(weight / total * 100, 4)) + "% " + str(weight) + "/" + str(total) + ": " + str(user.id))
 
 
 def get_maximum_benefit(member, benefit_roles):
@@ -333,12 +1128,65 @@ def get_maximum_benefit(member, benefit_roles):
     return temp_max
 
 
-async def get_chosen_weighted(choose_list, amount, server):
+def get_benefit(member, benefit_roles):
+    """
+    Returns the benefit of a member. Depending on MULTIPLE_BENEFITS, this is the sum or the maximum of the role-benefits.
+    :param member: Which member to check for
+    :param benefit_roles: List of roles with benefits set (get them from runtime_data!)
+    :return: The benefit for the given member
+    """
+    if MULTIPLE_BENEFITS:  # apply benefits from multiple roles or only the highest one?
+        logger.debug("Multiple benefits will be applied")
+
+        benefit = 0
+        for member_role in member.roles:  # for every role the member has on this server
+            if member_role.id in benefit_roles:  # if a benefit is set for this role
+                logger.debug(
+                    printuser(member) + " role-benefit for " + str(member_role) + ": " + str(benefit_roles[member_role.id]))
+                benefit += benefit_roles[member_role.id]
+        return benefit
+
+    logger.debug("Only the highest benefit will be applied")
+    return get_maximum_benefit(member, benefit_roles)
+
+
+async def get_user_weight(user, server, benefit_roles):
+    """
+    Returns a user's weight for choosing: one chance, plus the role-benefits, lowered by the win penalty.
+    :param user: User (or Member) to get the weight for
+    :param server: The server where choosing takes place
+    :param benefit_roles: List of roles with benefits set (get them from runtime_data!)
+    :return: Weight of the user
+    """
+    weight = 1
+
+    if benefit_roles:  # only do this if there are any benefit roles set for this server
+        # to check the roles, we have to get the Member object. Reactions usually only give us User objects
+        member = user
+        if not isinstance(user, discord.Member):
+            member = server.get_member(user.id)  # from the cache, if available
+        if not member:
+            try:
+                member = await server.fetch_member(user.id)
+            except discord.errors.NotFound:
+                member = None
+
+        if member:  # did we get a member object? This is False if the User is not a member of the server (anymore)
+            weight += get_benefit(member, benefit_roles)
+        else:  # user NOT member of the server (anymore)
+            logger.warning("User is no longer member of server, benefits not applied: " + printuser(user))
+
+    # users who won recently get a lower chance
+    return weight * get_win_penalty(server.id, user.id)
+
+
+async def get_chosen_weighted(choose_list, amount, server, round_entry):
     """
-    Chooses the people and also applies benefits (if available).
+    Chooses the people and also applies benefits and win penalties (if available).
     :param choose_list: List of users to choose from
     :param amount: How many people to choose
     :param server: The server where choosing takes place
+    :param round_entry: Record of this round (see new_round), gets the participants and weights
     :return: List of users that were chosen (unique users)
     """
     logger.debug("Choosing weighted")
@@ -351,86 +1199,330 @@ async def get_chosen_weighted(choose_list, amount, server):
     else:
         logger.debug(str(amount) + " demanded and " + str(len(choose_list)) + " reacted.")
 
-    # go through all users, go through all of their server roles and apply role-benefit
-    logger.debug("choose_list before: " + ", ".join([printuser(user) for user in choose_list]))
+    # every user has one chance, plus one more for each benefit of their server roles
+    logger.debug("choose_list: " + ", ".join([printuser(user) for user in choose_list]))
     logger.debug("Applying benefits to users")
     benefit_roles = get_runtime_data(server.id, 'rolebenefits')
-
-    if benefit_roles:  # only do this if there are any benefit roles set for this server
-        # we need to keep a copy of the original list
-        # else we would end with an infinite loop as users get added
-        choose_list_original = choose_list.copy()
-
-        for user in choose_list_original:  # for every user that would like to be chosen
-            # to check the roles, we have to get the Member object, as we only have User objects
-            member = await server.fetch_member(user.id)
-
-            if member:  # did we get a member object? This is False if the User is not a member of the server (anymore)
-                if MULTIPLE_BENEFITS:  # apply benefits from multiple roles or only the highest one?
-                    logger.debug("Multiple benefits will be applied")
-
-                    for member_role in member.roles:  # for every role the member has on this server
-                        if member_role.id in benefit_roles:  # if a benefit is set for this role
-                            benefit = benefit_roles[member_role.id]  # get the benefit for this role
-                            logger.debug(
-                                printuser(user) + " role-benefit for " + str(member_role) + ": " + str(benefit))
-
-                            # add the user as often as the role has set as a benefit
-                            for _ in range(benefit):
-                                logger.debug("Adding user once more to choose_list")
-                                choose_list.append(user)
-                else:  # only apply the highest benefit a user has
-                    logger.debug("Only the highest benefit will be applied")
-                    benefit = get_maximum_benefit(member, benefit_roles)
-
-                    # add the user as often as the role has set as a benefit
-                    for _ in range(benefit):
-                        logger.debug("Adding user once more to choose_list")
-                        choose_list.append(user)
-            else:  # user NOT member of the server (anymore)
-                logger.warning("User is no longer member of server, benefits not applied: " + printuser(user))
-    else:  # no benefit roles set for this server
+    if not benefit_roles:
         logger.debug("No benefit roles set. Skipping.")
 
+    weights = []  # weight of each user in choose_list
+    for user in choose_list:  # for every user that would like to be chosen
+        weights.append(await get_user_weight(user, server, benefit_roles))
+        round_entry['participants'].append(user.id)
+        round_entry['weights'].append(weights[-1])
+
     logger.debug("Applying done")
-    logger.debug("choose_list after: " + ", ".join([printuser(user) for user in choose_list]))
 
     logger.debug("Choosing starts")
     # as long as we do not have enough users chosen
     while len(chosen) < amount:
         # Log the probabilities (for debugging reasons only)
-        log_probabilities(choose_list)
-
-        # Highest index to choose
-        upper_index_boundary = len(choose_list) - 1
-
-        # random_index defaults to zero...
-        random_index = 0
-        # ... in case there is only one user left that can be chosen
-        if upper_index_boundary > 0:
-            # using secrets as random was not random enough
-            random_index = secrets.randbelow(upper_index_boundary + 1)
-
-        # get the random user object
-        chosen_user = choose_list[random_index]
-
-        logger.debug("RandomIndex " + str(random_index) + ", UpperIndexBoundary was " + str(upper_index_boundary))
+        log_probabilities(choose_list, weights)
+
+        # pick a random point between zero and the sum of all weights...
+        random_point = round_entry['rng'].random() * sum(weights)
+        # ... and find the user it belongs to. Defaults to the last one in case of rounding errors
+        random_index = len(choose_list) - 1
+        for index, weight in enumerate(weights):
+            random_point -= weight
+            if random_point < 0:
+                random_index = index
+                break
+
+        logger.debug("RandomIndex " + str(random_index) + ", UpperIndexBoundary was " + str(len(choose_list) - 1))
+
+        # remove the chosen user - else he could be chosen multiple times
+        chosen_user = choose_list.pop(random_index)
+        weights.pop(random_index)
         logger.debug("This user was chosen: " + printuser(chosen_user))
 
         # add user to list of chosen users (will be returned later)
         chosen.append(chosen_user)
 
-        # loop through the list to remove the chosen user entirely - else he could be chosen multiple times
-        for entry in list(choose_list):
-            if entry == chosen_user:
-                choose_list.remove(chosen_user)
-                logger.debug("Removed " + printuser(chosen_user) + " from choose_list")
-
     logger.debug("Choosing ended")
 
     return chosen
 
 
+async def cache_members(server, users):
+    """
+    Puts the Member objects of users into the cache, in a single request.
+    Only possible with the members intent, otherwise get_user_weight fetches them one by one.
+    :param server: The server the users are members of
+    :param users: List of up to 100 users
+    :return: nothing
+    """
+    missing = [user.id for user in users if not isinstance(user, discord.Member) and not server.get_member(user.id)]
+    if missing and MEMBERS_INTENT:
+        logger.debug("Querying " + str(len(missing)) + " member(s)")
+        try:
+            await server.query_members(user_ids=missing, limit=len(missing), cache=True)
+        except asyncio.TimeoutError:  # get_user_weight fetches them one by one then
+            logger.warning("Querying members timed out, fetching them one by one")
+
+
+async def add_to_reservoir(reservoir, batch, amount, server, benefit_roles, round_entry):
+    """
+    Weighs a batch of users and keeps those with the highest keys in the reservoir (see get_chosen_streaming).
+    :param reservoir: heap of (key, position, user), the lowest key is at the top. Gets updated
+    :param batch: List of users to add
+    :param amount: How many users the reservoir holds at most
+    :param server: The server where choosing takes place
+    :param benefit_roles: List of roles with benefits set (get them from runtime_data!)
+    :param round_entry: Record of this round (see new_round), gets the participants and weights
+    :return: nothing
+    """
+    if benefit_roles:  # look up the roles of the whole batch at once
+        await cache_members(server, batch)
+
+    for user in batch:
+        weight = await get_user_weight(user, server, benefit_roles)
+        round_entry['participants'].append(user.id)
+        round_entry['weights'].append(weight)
+
+        key = round_entry['rng'].random() ** (1 / weight)
+        position = len(round_entry['participants'])
+        if len(reservoir) < amount:
+            heapq.heappush(reservoir, (key, position, user))
+        elif key > reservoir[0][0]:  # user beats the lowest key in the reservoir
+            heapq.heapreplace(reservoir, (key, position, user))
+
+
+async def get_chosen_streaming(reaction, amount, server, round_entry):
+    """
+    Chooses the people while reading the users of a reaction, using weighted reservoir sampling (A-Res).
+    Every user gets the key random^(1/weight), the users with the highest keys are chosen.
+    This gives the same probabilities as get_chosen_weighted, but only keeps the chosen users (and the batch of users
+    currently read, see STREAMING_BATCH_SIZE) as objects in memory. For the round log, the id and weight of every
+    user are kept as well - 16 bytes per user, e.g. 800 KB for 50,000 users.
+    :param reaction: Reaction whose users to choose from
+    :param amount: How many people to choose
+    :param server: The server where choosing takes place
+    :param round_entry: Record of this round (see new_round), gets the participants and weights
+    :return: List of users that were chosen (unique users) and the amount of users that reacted
+    """
+    logger.debug("Choosing weighted while streaming")
+    benefit_roles = get_runtime_data(server.id, 'rolebenefits')
+    if benefit_roles and not MEMBERS_INTENT:
+        logger.warning("Benefits without the members intent - every user's roles have to be fetched on their own")
+
+    reservoir = []  # heap of (key, position, user), the lowest key is at the top
+    batch = []  # users read, but not yet weighted
+    async for user in reaction.users():  # the users are fetched page by page
+        if user == client.user:  # we reacted, too
+            continue
+
+        batch.append(user)
+        if len(batch) == STREAMING_BATCH_SIZE:
+            await add_to_reservoir(reservoir, batch, amount, server, benefit_roles, round_entry)
+            batch = []
+    await add_to_reservoir(reservoir, batch, amount, server, benefit_roles, round_entry)
+    lobby_users_amount = len(round_entry['participants'])
+
+    logger.debug("Choosing ended, " + str(lobby_users_amount) + " user(s) read")
+
+    # highest key first, this is the order the users would have been chosen in
+    return [entry[2] for entry in sorted(reservoir, reverse=True)], lobby_users_amount
+
+
+async def choose_streaming(interaction: discord.Interaction, reaction, amount, reference_new, treasure):
+    """
+    Choose-command for very large lobbies. Chooses the users while reading the reactions.
+    :param interaction: interaction of the choose-command
+    :param reaction: The thumbs up reaction
+    :param amount: How many users to choose
+    :param reference_new: Message users had to react to
+    :param treasure: Treasure to send to the chosen users (can be None)
+    :return: nothing
+    """
+    if amount > 0:  # check if at least one user should be chosen
+        round_entry = new_round(interaction.guild.id, ROUND_MODE_STREAMING, amount)
+        logger.debug("Sending info message to interaction")
+        await interaction.response.send_message(
+            "Choosing and informing " + str(amount) + " user(s) while reading the lobby. Please wait...\n"
+            "Seed commitment: `" + round_entry['commitment'].hex() + "`")
+
+        chosen, lobby_users_amount = await get_chosen_streaming(reaction, amount, interaction.guild, round_entry)
+        # we cannot choose more users than there are in the lobby, this is what gets logged
+        round_entry['amount'] = min(amount, lobby_users_amount)
+        logger.info(str(lobby_users_amount) + ' user(s) in lobby, chosen: ' + ", ".join(
+            [printuser(user) for user in chosen]))
+
+        if chosen:
+            await finish_round(interaction, reference_new, chosen, treasure, round_entry)
+        else:  # no users reacted to the message
+            logger.info("No user reacted to message")
+            await interaction.edit_original_response(
+                content="Whoops! No one was in the lobby! I cannot choose from 0 users!")
+    else:  # user told us to choose zero or fewer people - senseless!
+        logger.warning("Informing user as argument is out of allowed range: " + str(amount))
+        await interaction.response.send_message(
+            "Hey silly! I cannot choose from " + str(amount) + " user(s). **Try again, please!**")
+
+
+def split_announcement(header, lines):
+    """
+    Splits an announcement into messages Discord accepts (see MESSAGE_LIMIT).
+    Lines are never split, the header is only part of the first message.
+    :param header: First line(s) of the announcement
+    :param lines: List of lines following the header
+    :return: List of messages to send, in order
+    """
+    messages = []
+    current = header
+    for line in lines:
+        if len(current) + 1 + len(line) > MESSAGE_LIMIT:  # line does not fit anymore, start a new message
+            messages.append(current)
+            current = line
+        else:
+            current += "\n" + line
+    messages.append(current)
+
+    return messages
+
+
+def make_csv(header, rows):
+    """
+    Renders rows as CSV.
+    :param header: List of column names
+    :param rows: List of rows, each a list of values
+    :return: CSV as bytes
+    """
+    csv = ",".join(header) + "\n" + "".join([",".join([str(value) for value in row]) + "\n" for row in rows])
+    return csv.encode()
+
+
+def make_csv_file(filename, header, rows):
+    """
+    Creates a CSV file that can be attached to a message.
+    :param filename: Name of the file
+    :param header: List of column names
+    :param rows: List of rows, each a list of values
+    :return: discord.File containing the CSV
+    """
+    return discord.File(io.BytesIO(make_csv(header, rows)), filename=filename)
+
+
+def make_participants_csvs(rounds_list):
+    """
+    Renders the participants, weights and winners of rounds as CSV.
+    Takes long for large lobbies, so it is run in a separate thread.
+    :param rounds_list: List of dicts representing the rounds (see read_round)
+    :return: List of CSVs as bytes, one for each round
+    """
+    csvs = []
+    for round_entry in rounds_list:
+        winners = set(round_entry['winners'])
+        csvs.append(make_csv(['id', 'weight', 'chosen'],
+                             [[userid, weight, int(userid in winners)] for userid, weight in
+                              zip(round_entry['participants'], round_entry['weights'])]))
+    return csvs
+
+
+async def announce_chosen(userchannel, chosen):
+    """
+    Posts the chosen users to the public channel.
+    Large lists are split into multiple messages and get a CSV file with the user IDs attached.
+    If posting fails, the messages posted so far are deleted again, so no incomplete list stays behind.
+    :param userchannel: Channel to post the announcement to
+    :param chosen: List of users that were chosen
+    :return: nothing
+    """
+    messages = split_announcement("Alright... So who's it gonna be?\n**I choose you:**",
+                                  ["- <@" + str(user.id) + ">" for user in chosen])
+    logger.debug("Announcement consists of " + str(len(messages)) + " message(s)")
+
+    sent = []  # messages posted so far
+    try:
+        for index, message in enumerate(messages):
+            if index > 0:  # pace the messages
+                await asyncio.sleep(ANNOUNCEMENT_DELAY)
+
+            if index == len(messages) - 1 and len(chosen) >= ANNOUNCEMENT_FILE_THRESHOLD:
+                logger.debug("Attaching CSV file with the chosen users")
+                sent.append(await userchannel.send(message, file=make_csv_file('chosen.csv', ['id'],
+                                                                              [[user.id] for user in chosen])))
+            else:
+                sent.append(await userchannel.send(message))
+    except discord.errors.HTTPException:
+        logger.warning("Announcement failed after " + str(len(sent)) + " message(s), deleting them")
+        for message in sent:
+            try:
+                await message.delete()
+            except discord.errors.HTTPException:
+                logger.error("Could not delete incomplete announcement message " + str(message.id))
+        raise
+
+
+async def finish_round(interaction: discord.Interaction, reference_new, chosen, treasure, round_entry):
+    """
+    Announces the chosen users, informs them and closes the round.
+    The message to react to is only deleted if the announcement succeeded, so the round can be retried otherwise.
+    :param interaction: interaction of the choose-command
+    :param reference_new: Message users had to react to
+    :param chosen: List of users that were chosen
+    :param treasure: Treasure to send to the chosen users (can be None)
+    :param round_entry: Record of this round (see new_round), will be saved to the round log
+    :return: nothing
+    """
+    logger.debug("Informing users about the chosen ones")
+    # post result to the public chanel
+    userchannel = get_runtime_data(interaction.guild.id, 'userchannel')
+    try:
+        await announce_chosen(userchannel, chosen)
+    except discord.errors.HTTPException:
+        traceback.print_exc()
+        logger.error("Announcing the chosen users failed, keeping the message to react to")
+        await interaction.edit_original_response(
+            content="Whoops! I could not post the chosen users. The lobby is still open, try again!")
+        return
+
+    # delete the encouraging message
+    logger.debug("Deleting message to react to")
+    try:
+        await reference_new.delete()
+    except discord.errors.HTTPException as error:  # e.g. deleted meanwhile or missing permissions
+        logger.warning("Could not delete message to react to: " + str(error))
+        # the winners are announced, so the round is over anyway
+        set_runtime_data(interaction.guild.id, 'reference_new', None)
+
+    # send individual DMs to the chosen users
+    logger.debug("Sending DMs to chosen users")
+    for user in chosen:  # for every user that was chosen
+        msg = "**Congrats! You were chosen!**"
+
+        if treasure:  # send the treasure, if it is set for this server
+            msg += '\n**Your treasure:** ' + treasure
+
+        try:
+            await user.send(msg)
+        except discord.errors.Forbidden:
+            logger.warning("User does not allow DMs, informing interaction - " + printuser(user))
+            dm_backlog[user.id] = msg
+            await userchannel.send(
+                "<@" + str(user.id) + "> I am not allowed to send you a message (Right click on the server icon -> "
+                                      "Privacy -> \"Direct messages\" is not enabled). If you enable it (at least "
+                                      "for a short time) and send me a DM, I will inform you, too.")
+
+    # saving happens last, so a failure here cannot keep the chosen users from getting their treasure
+    try:
+        # remember the wins, so they lower the chances in the next rounds
+        for user in chosen:
+            record_win(interaction.guild.id, user.id)
+        save_win_history(interaction.guild.id)
+
+        # keep a record of the round, so it can be proven who was in the lobby and who won
+        round_entry['winners'].extend([user.id for user in chosen])
+        append_round(round_entry)
+    except (OSError, struct.error):
+        traceback.print_exc()
+        logger.error("Saving the win history or the round log failed")
+
+    logger.debug("Choosing done - editing info message")
+    await interaction.edit_original_response(content="Done! 🡺 <#" + str(userchannel.id) + ">")
+
+
 @client.event
 async def on_ready():
     """
@@ -449,6 +1541,12 @@ async def on_ready():
     # Now that the bot is ready, we can load runtime_data
     # this is a prerequisite as channel and role objects will be loaded
     await load_runtime_data()
+    load_win_history()
+    load_round_index()
+
+    # on_ready is called again after reconnecting, the janitor has to be started only once
+    if not janitor.is_running():
+        janitor.start()
     logger.debug("Ready! Startup completed.")
 
 
@@ -550,15 +1648,21 @@ async def getmodrole(interaction: discord.Interaction):
     """
     if is_management_permitted(interaction):
         logger.debug('Modrole requested ' + get_interaction_summary(interaction))
-        modrole = get_runtime_data(interaction.guild.id, 'modrole')  # get the role for this server from runtime_data
-        if modrole:  # if a modrole is set for this server
-            logger.debug("Modrole is set, id: " + str(modrole.id))
-            await interaction.response.send_message(
-                "Current modrole: " + modrole.name + "\nAdministrators are always able to use me, too.")
-        else:  # if a modrole is NOT set for this server
-            logger.debug("Modrole is NOT set")
-            await interaction.response.send_message(
-                "Currently no modrole is set.\nAdministrators are always able to use me.")
+        response = get_cached_response(interaction.guild.id, 'getmodrole')
+        if not response:  # nothing cached, render the response
+            modrole = get_runtime_data(interaction.guild.id, 'modrole')  # get the role for this server
+            if modrole:  # if a modrole is set for this server
+                logger.debug("Modrole is set, id: " + str(modrole.id))
+                # prefer the role from the server, it reflects renames
+                modrole = interaction.guild.get_role(modrole.id) or modrole
+                name = getattr(modrole, 'name', "unknown role (" + str(modrole.id) + ")")
+                response = "Current modrole: " + name + "\nAdministrators are always able to use me, too."
+            else:  # if a modrole is NOT set for this server
+                logger.debug("Modrole is NOT set")
+                response = "Currently no modrole is set.\nAdministrators are always able to use me."
+            set_cached_response(interaction.guild.id, 'getmodrole', response)
+
+        await interaction.response.send_message(response)
     else:
         await interaction.response.send_message("You do not have permission to use this command, sorry!")
 
@@ -614,15 +1718,18 @@ async def listbenefits(interaction: discord.Interaction):
     List the benefits on this server
     """
     if is_management_permitted(interaction):
-        benefitroles = get_runtime_data(interaction.guild.id, 'rolebenefits')  # get benefit roles for this server
-
-        summary = "These are the benefits currently configured for " + str(interaction.guild) + ":"
-        if benefitroles:  # if benefit roles are set for this server
-            for benefitroleid in benefitroles:  # for every role that has a benefit set
-                benefit_role = discord.utils.get(interaction.guild.roles, id=benefitroleid)  # get the role
-                summary += "\n- " + str(benefit_role) + ": " + str(benefitroles[benefitroleid])  # add benefit info
-        else:  # server has NO benefit roles set
-            summary += '\n- None configured!'
+        summary = get_cached_response(interaction.guild.id, 'listbenefits')
+        if not summary:  # nothing cached, render the summary
+            benefitroles = get_runtime_data(interaction.guild.id, 'rolebenefits')  # get benefit roles for this server
+
+            summary = "These are the benefits currently configured for " + str(interaction.guild) + ":"
+            if benefitroles:  # if benefit roles are set for this server
+                for benefitroleid in benefitroles:  # for every role that has a benefit set
+                    benefit_role = interaction.guild.get_role(benefitroleid)  # get the role
+                    summary += "\n- " + str(benefit_role) + ": " + str(benefitroles[benefitroleid])  # add benefit info
+            else:  # server has NO benefit roles set
+                summary += '\n- None configured!'
+            set_cached_response(interaction.guild.id, 'listbenefits', summary)
 
         # send summary to user/interaction
         await interaction.response.send_message(summary)
@@ -632,9 +1739,10 @@ async def listbenefits(interaction: discord.Interaction):
 
 @client.tree.command()
 @app_commands.describe(
-    amount='How many users to choose'
+    amount='How many users to choose',
+    streaming='Choose while reading the lobby - for very large lobbies'
 )
-async def choose(interaction: discord.Interaction, amount: int):
+async def choose(interaction: discord.Interaction, amount: int, streaming: bool = False):
     """
     Choose a specified amount of users.
     """
@@ -672,6 +1780,10 @@ async def choose(interaction: discord.Interaction, amount: int):
 
                         for reaction in reference_reactions:  # for each reaction users added to the message
                             if reaction.emoji == '👍':  # we are only interested in the thumbs up reaction
+                                if streaming:  # do not collect all the users first
+                                    await choose_streaming(interaction, reaction, amount, reference_new, treasure)
+                                    break
+
                                 # convert the result of reaction.users() to a list we can work with
                                 # caution! we get User objects here, not Members!
                                 thumbsup_users = [user async for user in reaction.users()]
@@ -686,51 +1798,21 @@ async def choose(interaction: discord.Interaction, amount: int):
                                         arg_int = int(amount)  # how many users to choose - try converting it to int
 
                                         if arg_int > 0:  # check if at least one user should be chosen
+                                            # we cannot choose more users than there are in the lobby
+                                            arg_int = min(arg_int, lobby_users_amount)
+                                            round_entry = new_round(interaction.guild.id, ROUND_MODE_WEIGHTED,
+                                                                    arg_int)
                                             logger.debug("Sending info message to interaction")
                                             await interaction.response.send_message(
-                                                "Choosing and informing " + str(arg_int) + " user(s). Please wait...")
+                                                "Choosing and informing " + str(arg_int) + " user(s). Please wait..."
+                                                "\nSeed commitment: `" + round_entry['commitment'].hex() + "`")
 
                                             # use the choosing function to select the users
                                             chosen = await get_chosen_weighted(thumbsup_users, arg_int,
-                                                                               interaction.guild)
-
-                                            # delete the encouraging message
-                                            logger.debug("Deleting message to react to")
-                                            await reference_new.delete()
-
-                                            logger.debug("Informing users about the chosen ones")
-                                            # post result to the public chanel
-                                            userchannel = get_runtime_data(interaction.guild.id, 'userchannel')
-                                            await userchannel.send(
-                                                "Alright... So who's it gonna be?\n**I choose you:**\n- <@" + "\n- <@".join(
-                                                    [str(user.id) + ">" for user in chosen]))
-
-                                            # send individual DMs to the chosen users
-                                            logger.debug("Sending DMs to chosen users")
-                                            for user in chosen:  # for every user that was chosen
-                                                msg = "**Congrats! You were chosen!**"
-
-                                                if treasure:  # send the treasure, if it is set for this server
-                                                    msg += '\n**Your treasure:** ' + treasure
-
-                                                try:
-                                                    await user.send(msg)
-                                                except discord.errors.Forbidden:
-                                                    logger.warning(
-                                                        "User does not allow DMs, informing interaction - " + printuser(
-                                                            user))
-                                                    dm_backlog[user.id] = msg
-                                                    await userchannel.send(
-                                                        "<@" + str(user.id) + "> I am not allowed to send you a "
-                                                                              "message (Right click on the server "
-                                                                              "icon -> Privacy -> \"Direct messages\" "
-                                                                              "is not enabled). If you enable it (at "
-                                                                              "least for a short time) and send me a "
-                                                                              "DM, I will inform you, too.")
-
-                                            logger.debug("Choosing done - editing info message")
-                                            await interaction.edit_original_response(
-                                                content="Done! 🡺 <#" + str(userchannel.id) + ">")
+                                                                               interaction.guild, round_entry)
+
+                                            await finish_round(interaction, reference_new, chosen, treasure,
+                                                               round_entry)
                                         else:  # user told us to choose zero or fewer people - senseless!
                                             logger.warning(
                                                 "Informing user as argument is out of allowed range: " + str(amount))
@@ -762,6 +1844,79 @@ async def choose(interaction: discord.Interaction, amount: int):
         await interaction.response.send_message("You do not have permission to use this command, sorry!")
 
 
+@client.tree.command()
+@app_commands.describe(
+    amount='How many rounds to show (up to 10)'
+)
+async def rounds(interaction: discord.Interaction, amount: app_commands.Range[int, 1, 10] = 5):
+    """
+    Shows the latest choosing-rounds of this server from the round log, with their participants attached.
+    """
+    if is_management_permitted(interaction):
+        logger.debug('Round log requested ' + get_interaction_summary(interaction))
+        # reading and rendering large rounds takes a while
+        await interaction.response.defer()
+
+        recent_rounds = get_recent_rounds(interaction.guild.id, amount)
+        lines = []
+        for round_entry in recent_rounds:
+            lines.append("**<t:" + str(int(round_entry['timestamp'])) + ":f>** - " + str(
+                len(round_entry['participants'])) + " user(s) in lobby, " + str(round_entry['amount']) +
+                " demanded, " + str(len(round_entry['winners'])) + " chosen (" + (
+                "streaming" if round_entry['mode'] == ROUND_MODE_STREAMING else "regular") + ")")
+            lines.append("Seed: `" + round_entry['seed'].hex() + "`")
+            lines.append("Seed commitment: `" + round_entry['commitment'].hex() + "`")
+            lines.extend(["- <@" + str(winner) + ">" for winner in round_entry['winners']])
+        if not lines:  # no rounds logged for this server
+            lines.append("- None logged yet!")
+
+        # do not ping the winners again
+        for message in split_announcement("These are the latest rounds on " + str(interaction.guild) + ":", lines):
+            await interaction.followup.send(message, allowed_mentions=discord.AllowedMentions.none())
+
+        # attach the participants of each round, as many files per message as Discord allows
+        csvs = await asyncio.get_running_loop().run_in_executor(None, make_participants_csvs, recent_rounds)
+        limit = interaction.guild.filesize_limit
+        files = []
+        files_size = 0
+        too_large = []
+        for round_entry, csv in zip(recent_rounds, csvs):
+            filename = 'round-' + str(int(round_entry['timestamp'])) + '.csv'
+            if len(csv) > limit:  # does not fit into a message at all
+                too_large.append(filename)
+                continue
+            if len(files) == 10 or files_size + len(csv) > limit:  # message is full
+                await interaction.followup.send("Participants and weights, in the order they were read:", files=files)
+                files = []
+                files_size = 0
+            files.append(discord.File(io.BytesIO(csv), filename=filename))
+            files_size += len(csv)
+        if files:
+            await interaction.followup.send("Participants and weights, in the order they were read:", files=files)
+        if too_large:
+            logger.warning("Round(s) too large to attach: " + ", ".join(too_large))
+            await interaction.followup.send("Too many participants to attach: " + ", ".join(too_large) +
+                                            ". Ask the bot's host for the round log.")
+    else:
+        await interaction.response.send_message("You do not have permission to use this command, sorry!")
+
+
+@client.tree.command()
+async def loadstats(interaction: discord.Interaction):
+    """
+    Shows how many commands of this server were admitted, queued or rejected because of load.
+    """
+    if is_management_permitted(interaction):
+        logger.debug('Load statistics requested ' + get_interaction_summary(interaction))
+        stats = admission_control.stats.get(interaction.guild.id, {'admitted': 0, 'queued': 0, 'shed': 0})
+        await interaction.response.send_message(
+            "Commands on " + str(interaction.guild) + " since my last restart:\n- Admitted: " + str(
+                stats['admitted']) + "\n- Had to wait: " + str(stats['queued']) + "\n- Rejected (busy): " + str(
+                stats['shed']))
+    else:
+        await interaction.response.send_message("You do not have permission to use this command, sorry!")
+
+
 @client.event
 async def on_message(message):
     """
@@ -786,6 +1941,81 @@ async def on_guild_join(guild):
     await client.tree.sync(guild=guild)
 
 
+@client.event
+async def on_guild_remove(guild):
+    """
+    When the bot left a server (or the server was deleted), remove all of its data.
+    """
+    logger.info("Bot was removed from Guild: " + guild.name)
+    evict_server(guild.id)
+    save_runtime_data()
+
+
+@client.event
+async def on_guild_available(guild):
+    """
+    When a server becomes available again (e.g. after a Discord outage), resolve its data if that did not happen yet.
+    """
+    if guild.id in unresolved_servers and guild.id in runtime_data:
+        logger.info("Server is available again, resolving its data: " + guild.name)
+        if await resolve_server_data(guild.id):
+            save_runtime_data()
+        invalidate_cached_responses(guild.id)
+
+
+@client.event
+async def on_guild_update(before, after):
+    """
+    When a server is renamed, drop its cached responses as they contain the server's name.
+    """
+    if before.name != after.name:
+        invalidate_cached_responses(after.id)
+
+
+@client.event
+async def on_guild_role_update(before, after):
+    """
+    When a role is changed (e.g. renamed), drop the cached responses of its server.
+    The stored modrole is replaced, so it reflects the change, too.
+    """
+    logger.debug("Role was updated: " + str(after) + " (" + str(after.id) + ")")
+    modrole = get_runtime_data(after.guild.id, 'modrole')
+    if modrole and modrole.id == after.id:
+        runtime_data[after.guild.id]['modrole'] = after
+    invalidate_cached_responses(after.guild.id)
+
+
+@client.event
+async def on_guild_role_delete(role):
+    """
+    When a role is deleted, remove its benefit and unset it as modrole.
+    """
+    logger.debug("Role was deleted: " + str(role) + " (" + str(role.id) + ")")
+    benefit_roles = get_runtime_data(role.guild.id, 'rolebenefits')
+    if benefit_roles and role.id in benefit_roles:
+        logger.info("Removing benefit of deleted role " + str(role))
+        set_rolebenefit(role.guild.id, role.id, 0)
+
+    modrole = get_runtime_data(role.guild.id, 'modrole')
+    if modrole and modrole.id == role.id:
+        logger.info("Deleted role was the modrole, unsetting it")
+        set_runtime_data(role.guild.id, 'modrole', None)
+
+    invalidate_cached_responses(role.guild.id)
+
+
+@client.event
+async def on_raw_message_delete(payload):
+    """
+    When the message to react to is deleted, the lobby is closed.
+    """
+    if payload.guild_id:
+        reference_new = get_runtime_data(payload.guild_id, 'reference_new')
+        if reference_new and reference_new.id == payload.message_id:
+            logger.debug("Message to react to was deleted, closing lobby on " + str(payload.guild_id))
+            set_runtime_data(payload.guild_id, 'reference_new', None)
+
+
 @client.tree.command()
 async def version(interaction: discord.Interaction):
     """